@@ -0,0 +1,70 @@
+# bench_intent.py
+"""
+意図解析のマイクロベンチマーク
+
+    python bench_intent.py                 # カタログから合成したクエリログで計測
+    python bench_intent.py queries.txt     # 1行1クエリのログファイルで計測
+"""
+import random
+import re
+import sys
+import time
+import unicodedata
+
+import query_intent
+import utils
+
+N_QUERIES = 100_000
+
+
+def synth_queries(df, n, seed=0):
+    rng = random.Random(seed)
+    words = (
+        df["category"].dropna().tolist()
+        + df["maker"].dropna().tolist()
+        + df["name"].dropna().tolist()
+        + ["人気の", "在庫切れの", "残りわずかの", "おすすめの", "安い", "ワイヤレス"]
+    )
+    tails = ["", "を3件", "を2つ", "トップ5", "ください", "が欲しい"]
+    return [f"{rng.choice(words)}{rng.choice(words)[:6]}{rng.choice(tails)}" for _ in range(n)]
+
+
+def naive_parse(prompt, keywords):
+    """
+    語彙ごとに正規化と部分一致を繰り返す素朴な実装（比較用）
+    """
+    p = unicodedata.normalize("NFKC", prompt).lower()
+    hits = [k for k in keywords if unicodedata.normalize("NFKC", k).lower() in p]
+    m = re.search(r"(\d+)\s*(?:件|つ|個)", p) or re.search(r"トップ\s*(\d+)", p)
+    return hits, int(m.group(1)) if m else 1
+
+
+def bench(label, fn, queries):
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:8.3f}s  {len(queries) / elapsed:12,.0f} q/s")
+
+
+def main():
+    df = utils._load_products_df()
+
+    start = time.perf_counter()
+    engine = query_intent.IntentEngine.from_catalog(df)
+    print(f"build        {time.perf_counter() - start:8.3f}s  patterns={len(engine.vocabulary)}")
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            queries = [ln.rstrip("\n") for ln in f if ln.strip()]
+    else:
+        queries = synth_queries(df, N_QUERIES)
+    print(f"queries      {len(queries):,}")
+
+    bench("aho-corasick", engine.parse, queries)
+    vocabulary = engine.vocabulary
+    bench("naive", lambda q: naive_parse(q, vocabulary), queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,27 @@
 画面表示に特化した関数定義
 """
 import logging
+import time
 from pathlib import Path
 
 import pandas as pd
 import streamlit as st
 
 import constants as ct
+from metrics import METRICS
 
 logger = logging.getLogger("app_logger")
 
 @st.cache_data(show_spinner=False)
 def _load_products_csv() -> pd.DataFrame:
     csv_path = Path(__file__).resolve().parent / "data" / "products.csv"
-    return pd.read_csv(csv_path, dtype=str, encoding="utf-8")
+    last_err = None
+    for enc in ("utf-8", "utf-8-sig", "cp932"):
+        try:
+            return pd.read_csv(csv_path, dtype=str, encoding=enc)
+        except Exception as e:
+            last_err = e
+    raise RuntimeError(f"products.csv を読み込めませんでした: {last_err!s}")
 
 def display_app_title():
     st.markdown(f"## {ct.APP_NAME}")
@@ -42,18 +50,94 @@ def display_conversation_log():
             with st.chat_message("assistant", avatar=ct.AI_ICON_FILE_PATH):
                 display_product(message["content"])
 
-def display_product(result):
-    """1件分の商品カードを描画（互換のため [doc] を受け取る）"""
-    logger = logging.getLogger("app_logger")
-    st.markdown("以下の商品をご提案いたします。")
-
-    # --- 文書→辞書
-    lines = result[0].page_content.split("\n")
+def _product_from_doc(doc) -> dict:
+    """Document（「列名: 値」形式）→ 辞書"""
     product = {}
-    for ln in lines:
+    for ln in doc.page_content.split("\n"):
         if ":" in ln:
             k, v = ln.split(":", 1)
             product[k.strip()] = v.strip()
+    return product
+
+@st.cache_resource(show_spinner=False)
+def _products_by_id() -> dict:
+    """商品ID → CSV行（dict）。カードごとに DataFrame を絞り込まないよう一度だけ作る"""
+    df = _load_products_csv()
+    return {str(r["id"]).strip(): r for r in df.fillna("").to_dict("records")}
+
+_IMAGE_ROOTS = [
+    Path(__file__).resolve().parent / "images" / "products",
+    Path(__file__).resolve().parent / "image" / "products",
+    Path(__file__).resolve().parent / "assets" / "images" / "products",
+    Path(__file__).resolve().parent / "static" / "images" / "products",
+    Path(__file__).resolve().parent / "images",
+]
+_IMAGE_EXTS = [".png", ".jpg", ".jpeg", ".webp"]
+
+# 解決済みの画像パス（使う前に存在を確認する）と、見つからなかった名前（画像フォルダの更新日時つき）
+_IMAGE_PATHS = {}
+_IMAGE_MISSES = {}
+
+def _image_roots_signature() -> tuple:
+    # ファイルの追加・リネームでフォルダの更新日時が変わる
+    return tuple(r.stat().st_mtime_ns if r.is_dir() else 0 for r in _IMAGE_ROOTS)
+
+def _find_image(stem_or_name: str, loose: bool = True):
+    """CSVの file_name / 商品ID → 画像パス。画像フォルダの変更（リネーム等）に追従する"""
+    key = (stem_or_name, loose)
+    cached = _IMAGE_PATHS.get(key)
+    if cached and Path(cached).is_file():
+        return cached
+    _IMAGE_PATHS.pop(key, None)
+
+    # 前回見つからず、その後フォルダが変わっていなければ探索しない
+    signature = _image_roots_signature()
+    if _IMAGE_MISSES.get(key) == signature:
+        return None
+
+    chosen = _resolve_image(stem_or_name, loose)
+    if chosen:
+        _IMAGE_PATHS[key] = chosen
+        _IMAGE_MISSES.pop(key, None)
+    else:
+        _IMAGE_MISSES[key] = signature
+    return chosen
+
+def _resolve_image(stem_or_name: str, loose: bool = True):
+    """CSVの file_name / 商品ID → 画像パス（複数パス探索）"""
+    name = Path(stem_or_name).name
+    stem = Path(stem_or_name).stem
+
+    # 厳密一致
+    for r in _IMAGE_ROOTS:
+        p = r / name
+        if p.is_file():
+            return str(p)
+    # 拡張子置換
+    for r in _IMAGE_ROOTS:
+        for ext in _IMAGE_EXTS:
+            p = r / f"{stem}{ext}"
+            if p.is_file():
+                return str(p)
+    if not loose:
+        return None
+    # ゆるい一致（stem一致・部分一致・大小無視）
+    for r in _IMAGE_ROOTS:
+        if not r.exists():
+            continue
+        for p in r.glob("*"):
+            if not p.is_file():
+                continue
+            nm = p.name
+            if Path(nm).stem.lower() == stem.lower():
+                return str(p)
+            if stem.lower() and (stem.lower() in nm.lower()):
+                return str(p)
+    return None
+
+def _display_product_card(product: dict):
+    """商品カードの文字情報を描画し、画像用のプレースホルダーを返す"""
+    st.markdown("以下の商品をご提案いたします。")
 
     # ① 見出し
     st.success(
@@ -64,10 +148,9 @@ def display_product(result):
     stock = (product.get("stock_status") or "").strip()
     if not stock:
         try:
-            df = _load_products_csv()
-            row = df[df["id"].astype(str) == str(product.get("id", ""))]
-            if not row.empty and "stock_status" in row.columns:
-                stock = (row.iloc[0]["stock_status"] or "").strip()
+            row = _products_by_id().get(str(product.get("id", "")).strip())
+            if row:
+                stock = (row.get("stock_status") or "").strip()
         except Exception as e:
             logger.warning(f"stock_status lookup skipped: {e}")
 
@@ -87,70 +170,88 @@ def display_product(result):
         wrap_lines=True,
     )
 
-    # ④ 画像表示（CSVの file_name → 複数パス探索）
+    # ④ 画像は後から差し込む
+    return st.empty()
+
+def _display_product_image(placeholder, product: dict):
+    """プレースホルダーに商品画像を描画（商品ID → CSVの file_name の順に複数パス探索）"""
     file_name = ""
     try:
-        df = _load_products_csv()
-        row = df[df["id"].astype(str) == str(product.get("id", ""))]
-        if not row.empty and "file_name" in row.columns:
-            file_name = str(row.iloc[0]["file_name"]).strip()
+        row = _products_by_id().get(str(product.get("id", "")).strip())
+        if row:
+            file_name = str(row.get("file_name") or "").strip()
     except Exception as e:
         logger.warning(f"image lookup skipped: {e}")
 
-    roots = [
-        Path(__file__).resolve().parent / "images" / "products",
-        Path(__file__).resolve().parent / "image" / "products",
-        Path(__file__).resolve().parent / "assets" / "images" / "products",
-        Path(__file__).resolve().parent / "static" / "images" / "products",
-        Path(__file__).resolve().parent / "images",
-    ]
-    exts = [".png", ".jpg", ".jpeg", ".webp"]
-
-    def _find_image(stem_or_name: str):
-        name = Path(stem_or_name).name
-        stem = Path(stem_or_name).stem
-
-        # 厳密一致
-        for r in roots:
-            p = r / name
-            if p.is_file():
-                return p
-        # 拡張子置換
-        for r in roots:
-            for ext in exts:
-                p = r / f"{stem}{ext}"
-                if p.is_file():
-                    return p
-        # ゆるい一致（stem一致・部分一致・大小無視）
-        for r in roots:
-            if not r.exists():
-                continue
-            for p in r.glob("*"):
-                if not p.is_file():
-                    continue
-                nm = p.name
-                if Path(nm).stem.lower() == stem.lower():
-                    return p
-                if stem.lower() and (stem.lower() in nm.lower()):
-                    return p
-        return None
-
+    # tools.py で {id}.拡張子 にリネーム済みのため ID を優先し、file_name は補助として使う。
+    # 短い数字の ID は部分一致（"2" → "12.jpg"）を避けるため厳密一致・拡張子置換のみ
     candidates = []
+    pid = str(product.get("id", "")).strip()
+    if pid:
+        candidates.append((pid, False))
     if file_name:
-        candidates.append(file_name)
-    else:
-        pid = str(product.get("id", "")).strip()
-        if pid:
-            candidates.append(pid)
+        candidates.append((file_name, True))
 
     chosen = None
-    for nm in candidates:
-        chosen = _find_image(nm)
+    for key in candidates:
+        chosen = _find_image(*key)
         if chosen:
             break
 
     if chosen:
-        st.image(str(chosen), width=400)
-    else:
-        st.info("画像ファイルが見つかりませんでした。")
+        try:
+            placeholder.image(chosen, width=400)
+            return
+        except Exception as e:
+            # 解決後にリネーム・削除された場合もカード全体の描画は続ける
+            logger.warning(f"image render skipped: {e}")
+            _IMAGE_PATHS.pop(key, None)
+    placeholder.info("画像ファイルが見つかりませんでした。")
+
+def display_product(result):
+    """1件分の商品カードを描画（互換のため [doc] を受け取る）"""
+    product = _product_from_doc(result[0])
+    placeholder = _display_product_card(product)
+    _display_product_image(placeholder, product)
+
+def display_products_streaming(results, started: float = None) -> list:
+    """
+    検索結果のイテレータから、準備できた商品カードを順に描画する。
+    画像は全カードの描画後にまとめて差し込み、描画したDocumentのリストを返す
+    """
+    started = time.perf_counter() if started is None else started
+    it = iter(results)
+
+    with st.spinner(ct.SPINNER_TEXT):
+        doc = next(it, None)
+
+    shown = []
+    pending = []
+    first_card = None
+    while doc is not None:
+        product = _product_from_doc(doc)
+        placeholder = _display_product_card(product)
+        placeholder.info(ct.IMAGE_LOADING_TEXT)
+        if first_card is None:
+            first_card = time.perf_counter() - started
+            METRICS.observe("render.first_card", first_card)
+        shown.append(doc)
+        pending.append((placeholder, product))
+        doc = next(it, None)
+
+    for placeholder, product in pending:
+        _display_product_image(placeholder, product)
 
+    if shown:
+        all_cards = time.perf_counter() - started
+        METRICS.observe("render.all_cards", all_cards)
+        logging.getLogger(ct.LOGGER_NAME).info({
+            "render": {
+                "cards": len(shown),
+                "first_card_ms": round(first_card * 1000, 3),
+                "all_cards_ms": round(all_cards * 1000, 3),
+                "mean_first_card_ms": round(METRICS.mean_ms("render.first_card"), 3),
+                "mean_all_cards_ms": round(METRICS.mean_ms("render.all_cards"), 3),
+            }
+        })
+    return shown
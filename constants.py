@@ -15,6 +15,7 @@ AI_ICON_FILE_PATH = "./images/ai_icon.jpg"
 ERROR_ICON = ":material/error:"
 CHAT_INPUT_HELPER_TEXT = "こちらからお探しの商品の特徴や名前を入力してください。"
 SPINNER_TEXT = "レコメンドする商品の検討中..."
+IMAGE_LOADING_TEXT = "画像を読み込み中..."
 
 
 # ==========================================
@@ -32,6 +33,40 @@ TOP_K = 5
 RETRIEVER_WEIGHTS = [0.5, 0.5]
 
 
+# ==========================================
+# リランキング設定系
+# ==========================================
+# 二段目の並べ替え対象とする候補数（Retrieverの取得件数もこの値まで広げる）
+RERANK_POOL_SIZE = 20
+# 融合順位 → スコア変換の定数（RRF の k）
+RERANK_RRF_K = 10
+RERANK_RETRIEVAL_WEIGHT = 1.0
+# 人気度（評価 × レビュー件数）の重み：通常時 / 「人気」を求められた時
+RERANK_PRIOR_WEIGHT = 0.2
+RERANK_POPULAR_WEIGHT = 1.0
+# 在庫・カテゴリの意図に合致した商品への加点
+RERANK_INTENT_WEIGHT = 1.0
+# 在庫切れ商品への減点（在庫切れを求められた場合は適用しない）
+RERANK_STOCK_PENALTY = 1.0
+# MMR の関連度と多様性のバランス（1.0 で多様性を考慮しない）
+RERANK_MMR_LAMBDA = 0.7
+
+
+# ==========================================
+# 商品名の高速検索設定系
+# ==========================================
+# あいまい一致を採用する Dice 係数の下限と、2位との最小差
+NAME_MATCH_THRESHOLD = 0.75
+NAME_MATCH_MARGIN = 0.1
+
+
+# ==========================================
+# 検索結果キャッシュ設定系
+# ==========================================
+# 検索結果をキャッシュする入力の件数
+SEARCH_CACHE_SIZE = 256
+
+
 # ==========================================
 # RAG参照用のデータソース系
 # ==========================================
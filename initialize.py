@@ -124,7 +124,9 @@ def initialize_retriever():
 
     # ==== ここからキャッシュ化 ====
     stat = csv_path.stat()
-    sig = f"{stat.st_mtime_ns}:{stat.st_size}:{ct.TOP_K}:{tuple(ct.RETRIEVER_WEIGHTS)}:{bool(os.getenv('OPENAI_API_KEY'))}"
+    # 二段目のリランキング用に候補プールの件数まで取得する
+    top_k = max(ct.TOP_K, ct.RERANK_POOL_SIZE)
+    sig = f"{stat.st_mtime_ns}:{stat.st_size}:{top_k}:{tuple(ct.RETRIEVER_WEIGHTS)}:{bool(os.getenv('OPENAI_API_KEY'))}"
 
     @st.cache_resource(show_spinner=False)
     def _build_retriever(_signature: str):
@@ -151,23 +153,48 @@ def initialize_retriever():
 
         embeddings = OpenAIEmbeddings()
         db = Chroma.from_documents(docs, embedding=embeddings)
-        retriever_vec = db.as_retriever(search_kwargs={"k": ct.TOP_K})
+        retriever_vec = db.as_retriever(search_kwargs={"k": top_k})
 
         bm25 = BM25Retriever.from_texts(
             docs_all,
             preprocess_func=utils.preprocess_func,
-            k=ct.TOP_K
+            k=top_k
         )
 
-        return EnsembleRetriever(
+        retriever = EnsembleRetriever(
             retrievers=[bm25, retriever_vec],
             weights=ct.RETRIEVER_WEIGHTS
         )
+        return retriever, product_vectors(db)
 
-    st.session_state.retriever = _build_retriever(sig)
+    st.session_state.retriever, st.session_state.product_vectors = _build_retriever(sig)
     # ==== ここまでキャッシュ化 ====
 
 
+def product_vectors(db) -> dict:
+    """
+    Chromaに登録済みの埋め込みを商品ID単位で取り出す（リランキングの多様性計算で再利用）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    try:
+        got = db.get(include=["embeddings", "documents"])
+    except Exception as e:
+        logger.warning(f"embedding export skipped: {e}")
+        return {}
+
+    documents = got.get("documents")
+    embeddings = got.get("embeddings")
+    if documents is None or embeddings is None:
+        return {}
+
+    vectors = {}
+    for text, vec in zip(documents, embeddings):
+        pid = utils.id_from_text(text)
+        if pid and vec is not None:
+            vectors[pid] = vec
+    return vectors
+
+
 def adjust_string(s):
     """
     Windows環境でRAGが正常動作するよう調整
@@ -10,6 +10,7 @@ from initialize import initialize
 import components as cn
 import utils
 import logging
+import time
 
 try:
     initialize()
@@ -41,26 +42,25 @@ except Exception as e:
 chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
 
 if chat_message:
+    started = time.perf_counter()
     logger.info({"message": chat_message})
     with st.chat_message("user", avatar=ct.USER_ICON_FILE_PATH):
         st.markdown(chat_message)
 
     with st.chat_message("assistant", avatar=ct.AI_ICON_FILE_PATH):
-        with st.spinner(ct.SPINNER_TEXT):
-            try:
-                # ★ N件対応の検索
-                results = utils.search_products(chat_message)
-            except Exception as e:
-                logger.error(f"{ct.RECOMMEND_ERROR_MESSAGE}\n{e}")
-                st.error(utils.build_error_message(ct.RECOMMEND_ERROR_MESSAGE))
-                st.stop()
-                raise
+        try:
+            # ★ N件対応の検索：準備できた商品から順にカードを表示（画像は後から差し込み）
+            results = cn.display_products_streaming(
+                utils.iter_search_products(chat_message),
+                started=started,
+            )
+        except Exception as e:
+            logger.error(f"{ct.RECOMMEND_ERROR_MESSAGE}\n{e}")
+            st.error(utils.build_error_message(ct.RECOMMEND_ERROR_MESSAGE))
+            st.stop()
+            raise
 
-            # ★ N件を個別カードで表示（互換のため [doc] で渡す）
-            for doc in results:
-                cn.display_product([doc])
-
-            logger.info({"message": results})
+        logger.info({"message": results})
 
     st.session_state.messages.append({"role": "user", "content": chat_message})
     st.session_state.messages.append({"role": "assistant", "content": results})
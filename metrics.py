@@ -0,0 +1,45 @@
+"""
+このファイルは、検索パイプラインの計測値（件数・処理時間）を集計する処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import threading
+from collections import Counter
+
+
+############################################################
+# 関数定義
+############################################################
+
+class PipelineMetrics:
+    """
+    プロセス内で共有する件数・処理時間の集計
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._timings = {}
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] += n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            count, total = self._timings.get(name, (0, 0.0))
+            self._timings[name] = (count + 1, total + seconds)
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return self._counts[name]
+
+    def mean_ms(self, name: str) -> float:
+        with self._lock:
+            count, total = self._timings.get(name, (0, 0.0))
+        return total / count * 1000 if count else 0.0
+
+
+METRICS = PipelineMetrics()
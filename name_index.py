@@ -0,0 +1,105 @@
+"""
+このファイルは、商品名による高速検索（完全一致・あいまい一致）の索引が記述されたファイルです。
+ユーザー入力がほぼ商品名そのものの場合、Retriever を通さずに商品を特定するために使います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+############################################################
+# 関数定義
+############################################################
+
+# 『』や記号・空白は照合時に無視する
+_STRIP_RE = re.compile(r"[\W_]+")
+_ALIAS_RE = re.compile(r"[『「](.+?)[』」]")
+
+
+def normalize_name(text: str) -> str:
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _STRIP_RE.sub("", text)
+
+
+def _bigrams(text: str) -> set:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class NameIndex:
+    """
+    商品名の完全一致ハッシュと文字 bigram の転置索引
+    """
+
+    def __init__(self, df: pd.DataFrame, threshold: float, margin: float, min_length: int = 4):
+        self._threshold = threshold
+        self._margin = margin
+        self._min_length = min_length
+
+        names = df["name"].fillna("").astype(str).tolist()
+        self._n = len(names)
+
+        # 完全一致：正規化した商品名、および『』内の愛称（カタログ内で一意な場合のみ）
+        self._exact = {}
+        alias_rows = {}
+        for row, name in enumerate(names):
+            key = normalize_name(name)
+            if key:
+                self._exact.setdefault(key, row)
+            for alias in _ALIAS_RE.findall(name):
+                alias_rows.setdefault(normalize_name(alias), set()).add(row)
+        for alias, rows in alias_rows.items():
+            if alias and len(rows) == 1:
+                self._exact.setdefault(alias, next(iter(rows)))
+
+        # あいまい一致：bigram → 商品行番号の配列
+        postings = {}
+        sizes = np.zeros(self._n, dtype=np.float64)
+        for row, name in enumerate(names):
+            grams = _bigrams(normalize_name(name))
+            sizes[row] = len(grams)
+            for g in grams:
+                postings.setdefault(g, []).append(row)
+        self._postings = {g: np.asarray(rows, dtype=np.intp) for g, rows in postings.items()}
+        self._sizes = sizes
+
+    def lookup(self, prompt: str):
+        """
+        確信度の高い商品が見つかれば (行番号, スコア, 種別) を、なければ None を返す
+        """
+        key = normalize_name(prompt)
+        if len(key) < self._min_length or self._n == 0:
+            return None
+
+        row = self._exact.get(key)
+        if row is not None:
+            return row, 1.0, "exact"
+
+        grams = _bigrams(key)
+        hits = [self._postings[g] for g in grams if g in self._postings]
+        if not hits:
+            return None
+
+        # Dice 係数 = 2 × 共通 bigram 数 / (入力の bigram 数 + 商品名の bigram 数)
+        shared = np.bincount(np.concatenate(hits), minlength=self._n)
+        dice = 2.0 * shared / (len(grams) + self._sizes)
+
+        # 上位2件だけ分かればよいので全体はソートしない
+        if self._n > 1:
+            top = np.argpartition(-dice, 1)[:2]
+            best, second = float(dice[top[0]]), float(dice[top[1]])
+        else:
+            top = [0]
+            best, second = float(dice[0]), 0.0
+        if best >= self._threshold and best - second >= self._margin:
+            return int(top[0]), best, "fuzzy"
+        return None
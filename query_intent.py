@@ -0,0 +1,204 @@
+"""
+このファイルは、ユーザー入力から検索意図（在庫・人気・カテゴリ・メーカー・件数）を解析する処理が記述されたファイルです。
+語彙は products.csv の category / maker / name 列と同義語から作成し、Aho-Corasick 法で入力を一度だけ走査します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import unicodedata
+from collections import deque
+
+import pandas as pd
+
+
+############################################################
+# 語彙の定義
+############################################################
+_STOCK_LOW = {"少", "すく", "わずか", "残りわずか", "わず"}
+_STOCK_NONE = {"ない", "無し", "なし", "在庫切れ"}
+_POPULAR = {"人気", "レビュー", "評価", "評判", "売れ", "ランキング"}
+
+# 同義語 → カタログ上の表記
+_SYNONYMS = {
+    "イヤホン": "イヤホン",
+    "ヘッドホン": "イヤホン",
+    "ear": "イヤホン",
+    "ワイヤレス": "ワイヤレス",
+    "ライト": "ライト",
+    "照明": "ライト",
+    "lamp": "ライト",
+    "加湿器": "加湿器",
+    "humid": "加湿器",
+    "枕": "枕",
+    "ピロー": "枕",
+    "時計": "ウォッチ",
+    "ウォッチ": "ウォッチ",
+}
+
+# 商品名から語彙を切り出す（カタカナ・漢字・英数字の連続）
+_NAME_TERM_RE = re.compile(r"[ァ-ヴー]{2,}|[一-龠々]{2,}|[a-z0-9]{3,}")
+
+# カテゴリ候補の優先度（同義語・category 列 > 商品名から切り出した語）
+_PRIORITY = {"category": 1, "maker": 1, "term": 0}
+
+# 件数指定（「3件」「2つ」「4個」「トップ3」）
+_COUNT_RE = re.compile(r"(\d+)\s*(?:件|つ|個)")
+_TOP_RE = re.compile(r"トップ\s*(\d+)")
+
+
+def normalize(text: str) -> str:
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    return unicodedata.normalize("NFKC", text).lower().strip()
+
+
+############################################################
+# Aho-Corasick
+############################################################
+
+class _Automaton:
+    """
+    複数パターンの同時照合器（出現位置とパターン番号を返す）
+    """
+
+    def __init__(self, patterns: list):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for pid, pat in enumerate(patterns):
+            state = 0
+            for ch in pat:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(pid)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def findall(self, text: str):
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pid in out[state]:
+                yield end, pid
+
+
+############################################################
+# 意図解析
+############################################################
+
+class IntentEngine:
+    """
+    カタログの語彙から作る意図解析器（カタログ更新ごとに一度だけ作成）
+    """
+
+    def __init__(self, vocabulary: list):
+        # vocabulary: [(パターン, 種別, 値)]
+        entries = {}
+        for pattern, kind, value in vocabulary:
+            pat = normalize(pattern)
+            if not pat:
+                continue
+            entries.setdefault(pat, [])
+            if (kind, value) not in entries[pat]:
+                entries[pat].append((kind, value))
+        self._patterns = list(entries)
+        self._meanings = [entries[p] for p in self._patterns]
+        self._automaton = _Automaton(self._patterns)
+
+    @property
+    def vocabulary(self) -> list:
+        """正規化済みの照合パターン一覧"""
+        return list(self._patterns)
+
+    @classmethod
+    def from_catalog(cls, df: pd.DataFrame) -> "IntentEngine":
+        vocabulary = []
+        vocabulary += [(w, "stock", "none") for w in _STOCK_NONE]
+        vocabulary += [(w, "stock", "low") for w in _STOCK_LOW]
+        vocabulary += [(w, "popular", "") for w in _POPULAR]
+        vocabulary += [(w, "category", v) for w, v in _SYNONYMS.items()]
+
+        for cat in df["category"].dropna().astype(str).str.strip().unique():
+            if not cat:
+                continue
+            vocabulary.append((cat, "category", cat))
+            for part in re.split(r"[・/／]", cat):
+                if part.strip() and part.strip() != cat:
+                    vocabulary.append((part.strip(), "category", part.strip()))
+
+        for maker in df["maker"].dropna().astype(str).str.strip().unique():
+            if maker:
+                vocabulary.append((maker, "maker", maker))
+
+        # 商品名から切り出した語はカテゴリより優先度を下げる（"term"）
+        for name in df["name"].dropna().astype(str):
+            for term in _NAME_TERM_RE.findall(normalize(name)):
+                vocabulary.append((term, "term", term))
+
+        return cls(vocabulary)
+
+    def parse(self, prompt: str, default_count: int = 1, count_limit: int = 5) -> dict:
+        """
+        入力を一度走査し、在庫・人気・カテゴリ・メーカー・件数をまとめて返す
+        """
+        p = normalize(prompt)
+
+        stock_hits = set()
+        popular = False
+        # カテゴリ・メーカーは (語彙の出所, 出現位置, 長さ) の順で比較して採用する。
+        # 同義語・category 列の語を商品名由来の語より優先し、日本語は主要語が後ろに
+        # 来やすいため、より後ろで終わる語を優先する
+        best = {"category": ("", (-1, -1, 0)), "maker": ("", (-1, -1, 0))}
+        for end, pid in self._automaton.findall(p):
+            length = len(self._patterns[pid])
+            for kind, value in self._meanings[pid]:
+                if kind == "stock":
+                    stock_hits.add(value)
+                elif kind == "popular":
+                    popular = True
+                else:
+                    slot = "maker" if kind == "maker" else "category"
+                    rank = (_PRIORITY[kind], end, length)
+                    if rank > best[slot][1]:
+                        best[slot] = (value, rank)
+
+        stock = "any"
+        if "none" in stock_hits:
+            stock = "none"
+        elif "low" in stock_hits:
+            stock = "low"
+
+        return {
+            "stock": stock,
+            "popular": popular,
+            "category": best["category"][0],
+            "maker": best["maker"][0],
+            "count": _count_from_normalized(p, default_count, count_limit),
+        }
+
+
+def _count_from_normalized(p: str, default: int, limit: int) -> int:
+    m = _COUNT_RE.search(p) or _TOP_RE.search(p)
+    n = int(m.group(1)) if m else default
+    return max(1, min(limit, n))
@@ -0,0 +1,227 @@
+"""
+このファイルは、検索結果の二段目の並べ替え（リランキング）処理が記述されたファイルです。
+商品ごとの特徴量はカタログ読み込み時に一度だけ計算し、クエリごとの処理は NumPy の配列演算で行います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import unicodedata
+import zlib
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import constants as ct
+
+
+############################################################
+# 特徴量
+############################################################
+
+# 文字 bigram をハッシュして作る埋め込み（Chroma の埋め込みが使えない場合の代替）の次元数
+_EMBED_DIM = 512
+
+
+@dataclass(frozen=True)
+class CatalogFeatures:
+    """
+    カタログ全体の商品特徴量（行番号 = products.csv の行順）
+    """
+    frame: pd.DataFrame
+    ids: np.ndarray
+    id_to_row: dict = field(repr=False)
+    popularity: np.ndarray = field(repr=False)
+    stock_none: np.ndarray = field(repr=False)
+    stock_low: np.ndarray = field(repr=False)
+    search_text: np.ndarray = field(repr=False)
+    makers: np.ndarray = field(repr=False)
+    embeddings: np.ndarray = field(repr=False)
+
+
+def _embed_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\s+", "", text)
+
+
+def _popularity_prior(df: pd.DataFrame) -> np.ndarray:
+    """
+    評価値をレビュー件数で補正したベイズ平均を 0〜1 に正規化
+    """
+    score = pd.to_numeric(df["score"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    reviews = (
+        pd.to_numeric(df["review_number"].fillna("").str.replace(",", ""), errors="coerce")
+        .fillna(0.0)
+        .to_numpy(dtype=float)
+    )
+    if len(score) == 0:
+        return np.zeros(0)
+
+    rated = reviews > 0
+    prior_mean = score[rated].mean() if rated.any() else 0.0
+    prior_weight = np.median(reviews[rated]) if rated.any() else 0.0
+    bayes = (reviews * score + prior_weight * prior_mean) / np.maximum(reviews + prior_weight, 1e-9)
+
+    span = bayes.max() - bayes.min()
+    if span <= 0:
+        return np.zeros_like(bayes)
+    return (bayes - bayes.min()) / span
+
+
+def _hashed_embeddings(texts: list) -> np.ndarray:
+    """
+    文字 bigram の TF-IDF をハッシュで固定次元に落とした L2 正規化済みベクトル
+    """
+    mat = np.zeros((len(texts), _EMBED_DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        t = _embed_text(text)
+        grams = [t[j:j + 2] for j in range(len(t) - 1)] or ([t] if t else [])
+        for g in grams:
+            mat[i, zlib.crc32(g.encode("utf-8")) % _EMBED_DIM] += 1.0
+
+    doc_freq = (mat > 0).sum(axis=0)
+    idf = np.log((1.0 + len(texts)) / (1.0 + doc_freq)) + 1.0
+    mat *= idf.astype(np.float32)
+
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.where(norms > 0, norms, 1.0)
+
+
+def _vector_embeddings(ids: np.ndarray, vectors: dict):
+    """
+    商品ID → 埋め込み（Chroma の登録済みベクトル）を行順の L2 正規化済み行列にする。
+    カタログ内に埋め込みのない商品があれば None
+    """
+    if not vectors or any(pid not in vectors for pid in ids):
+        return None
+    mat = np.asarray([vectors[pid] for pid in ids], dtype=np.float32)
+    if mat.ndim != 2:
+        return None
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.where(norms > 0, norms, 1.0)
+
+
+def build_features(df: pd.DataFrame, vectors: dict = None) -> CatalogFeatures:
+    """
+    products.csv の DataFrame から商品特徴量を作成
+    （vectors: 商品ID → 埋め込み。使えない場合は文字 bigram のハッシュ埋め込みで代替）
+    """
+    df = df.reset_index(drop=True)
+    ids = df["id"].fillna("").astype(str).str.strip().to_numpy()
+    stock = df["stock_status"].fillna("").astype(str).str.strip()
+
+    texts = (
+        df["name"].fillna("") + " " + df["category"].fillna("") + " " + df["description"].fillna("")
+    ).tolist()
+
+    # カテゴリ・メーカー照合用（小文字化済み。項目をまたいで一致しないよう改行で連結）
+    search_text = (
+        df["name"].fillna("") + "\n" + df["category"].fillna("") + "\n" + df["description"].fillna("")
+    ).str.lower().to_numpy()
+    makers = df["maker"].fillna("").astype(str).str.strip().str.lower().to_numpy()
+
+    embeddings = _vector_embeddings(ids, vectors)
+    if embeddings is None:
+        embeddings = _hashed_embeddings(texts)
+
+    return CatalogFeatures(
+        frame=df,
+        ids=ids,
+        id_to_row={pid: i for i, pid in enumerate(ids) if pid},
+        popularity=_popularity_prior(df),
+        stock_none=(stock == ct.STOCK_NONE_TEXT).to_numpy(),
+        stock_low=(stock == ct.STOCK_LOW_TEXT).to_numpy(),
+        search_text=search_text,
+        makers=makers,
+        embeddings=embeddings,
+    )
+
+
+def match_intent(features: CatalogFeatures, rows: np.ndarray, stock: str, category: str, maker: str = "") -> np.ndarray:
+    """
+    候補（カタログの行番号、-1 は不明）ごとに在庫・カテゴリ・メーカーの意図に合致するかのマスク。
+    照合は候補の行だけに対して、事前計算済みの特徴量で行う
+    """
+    known = rows >= 0
+    safe = np.where(known, rows, 0)
+    mask = known.copy()
+
+    if stock == "none":
+        mask &= features.stock_none[safe]
+    elif stock == "low":
+        mask &= features.stock_low[safe]
+    elif stock == "any":
+        mask &= ~features.stock_none[safe]
+
+    if category:
+        cat = category.lower()
+        texts = features.search_text[safe]
+        mask &= np.fromiter((cat in t for t in texts), dtype=bool, count=len(texts))
+
+    if maker:
+        mask &= features.makers[safe] == maker.strip().lower()
+    return mask
+
+
+############################################################
+# リランキング
+############################################################
+
+def _mmr(relevance: np.ndarray, embeddings: np.ndarray, k: int, lam: float) -> list:
+    """
+    MMR で k 件を貪欲に選択（同点は検索順位の高い方を優先）
+    """
+    n = len(relevance)
+    max_sim = np.zeros(n)
+    available = np.ones(n, dtype=bool)
+    selected = []
+    for _ in range(min(k, n)):
+        gain = np.where(available, lam * relevance - (1.0 - lam) * max_sim, -np.inf)
+        i = int(np.argmax(gain))
+        selected.append(i)
+        available[i] = False
+        np.maximum(max_sim, embeddings @ embeddings[i], out=max_sim)
+    return selected
+
+
+def rerank(
+    features: CatalogFeatures,
+    rows,
+    want: int,
+    stock: str = "any",
+    category: str = "",
+    maker: str = "",
+    popular: bool = False,
+) -> list:
+    """
+    検索順に並んだ候補（カタログの行番号、不明な商品は -1）を並べ替え、
+    採用する候補のインデックスを want 件まで返す
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    n = len(rows)
+    if n == 0 or want <= 0:
+        return []
+
+    known = rows >= 0
+    safe = np.where(known, rows, 0)
+
+    # Ensemble（RRF）の融合順位をスコア化
+    retrieval = (ct.RERANK_RRF_K + 1.0) / (ct.RERANK_RRF_K + 1.0 + np.arange(n))
+    popularity = np.where(known, features.popularity[safe], 0.0)
+    matched = match_intent(features, rows, stock, category, maker)
+    out_of_stock = np.where(known, features.stock_none[safe], False)
+
+    prior_weight = ct.RERANK_POPULAR_WEIGHT if popular else ct.RERANK_PRIOR_WEIGHT
+    relevance = (
+        ct.RERANK_RETRIEVAL_WEIGHT * retrieval
+        + prior_weight * popularity
+        + ct.RERANK_INTENT_WEIGHT * matched
+    )
+    # 在庫切れを求められた場合は減点しない
+    if stock == "any":
+        relevance = relevance - ct.RERANK_STOCK_PENALTY * out_of_stock
+
+    embeddings = features.embeddings[safe] * known[:, None]
+    return _mmr(relevance, embeddings, want, ct.RERANK_MMR_LAMBDA)
@@ -2,10 +2,16 @@
 import os
 import csv
 import sys
+import json
+import argparse
+import importlib.util
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 CSV_PATH = "data/products.csv"
 IMG_DIR  = "images/products"
 LOG_PATH = "image_rename_log.txt"
+MANIFEST_PATH = "image_rename_manifest.json"
 
 def open_csv_safely(path):
     """
@@ -15,10 +21,9 @@ def open_csv_safely(path):
     for enc in ("utf-8", "utf-8-sig", "cp932"):
         try:
             f = open(path, "r", encoding=enc, newline="")
-            # ヘッダー1行だけ読んで戻す（読み取り確認）
-            pos = f.tell()
-            f.readline()
-            f.seek(pos)
+            # 全体を読んで戻す（読み取り確認）
+            f.read()
+            f.seek(0)
             print(f"🔎 CSV encoding detected: {enc}")
             return f
         except Exception as e:
@@ -28,7 +33,146 @@ def open_csv_safely(path):
 def normalize(s: str) -> str:
     return (s or "").strip().lower().replace(" ", "_").replace("-", "_")
 
-def main():
+GRAM = 3
+
+def _grams(s):
+    return {s[i:i + GRAM] for i in range(len(s) - GRAM + 1)}
+
+def build_indexes(files):
+    """
+    画像一覧から索引を作る
+      by_name: 小文字のファイル名 → ファイル名
+      by_stem: 小文字の stem → ファイル名（一覧順で最初のもの）
+      by_gram: 正規化した stem の文字 3-gram → 一覧上の位置の集合（部分一致の候補絞り込み用）
+      stems  : 一覧順の (ファイル名, 正規化した stem)
+    """
+    by_name, by_stem, by_gram = {}, {}, {}
+    stems = []
+    for pos, f in enumerate(files):
+        by_name.setdefault(f.lower(), f)
+        by_stem.setdefault(os.path.splitext(f.lower())[0], f)
+        fl = normalize(os.path.splitext(f)[0])
+        stems.append((f, fl))
+        for g in _grams(fl):
+            by_gram.setdefault(g, set()).add(pos)
+    return by_name, by_stem, by_gram, stems
+
+def _substring_candidates(words, by_gram, stems):
+    """
+    words をすべて部分文字列として含みうるファイルの位置（一覧順）。
+    3文字以上の語の 3-gram をすべて持つファイルだけに絞り込む
+    """
+    pos = None
+    for w in words:
+        for g in _grams(w):
+            hits = by_gram.get(g, set())
+            pos = set(hits) if pos is None else pos & hits
+            if not pos:
+                return []
+    return sorted(pos) if pos is not None else range(len(stems))
+
+def find_image(pid, name, file_name_hint, indexes, claimed):
+    by_name, by_stem, by_gram, stems = indexes
+
+    def _free(f):
+        return f if f and f not in claimed else None
+
+    # 0) すでに {id}.拡張子 になっていればそれを使う
+    target = _free(by_stem.get(pid.lower()))
+    if target:
+        return target
+
+    # 1) file_name があればそれを優先（拡張子はなんでもOK）
+    if file_name_hint:
+        try_name = file_name_hint.lower()
+        target = _free(by_name.get(try_name)) or _free(by_stem.get(os.path.splitext(try_name)[0]))
+        if target:
+            return target
+
+    # 2) ダメなら商品名の部分一致でざっくり探す（2語くらい一致で採用）
+    words = [w for w in normalize(name).split("_") if w][:2]
+    if words:
+        for pos in _substring_candidates(words, by_gram, stems):
+            f, fl = stems[pos]
+            if f not in claimed and all(w in fl for w in words):
+                return f
+    return None
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠ マニフェストを読み込めませんでした（全件を再処理します）: {e}")
+        return {}
+
+def save_manifest(path, manifest):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def _stat(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def is_unchanged(entry, name, file_name_hint, file_set):
+    """
+    前回実行時から商品行・画像ファイルが変わっていなければ True
+    """
+    if not entry:
+        return False
+    if entry.get("name") != name or entry.get("file_name") != file_name_hint:
+        return False
+    image = entry.get("image")
+    if image not in file_set:
+        return False
+    try:
+        cur = _stat(os.path.join(IMG_DIR, image))
+    except OSError:
+        return False
+    return cur["size"] == entry.get("size") and cur["mtime_ns"] == entry.get("mtime_ns")
+
+def validate_image(path):
+    """
+    画像を最後までデコードできるか確認（別プロセスで実行）
+    戻り値: (path, エラーメッセージ or None)
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            im.verify()
+        # verify() 後は再オープンが必要
+        with Image.open(path) as im:
+            im.load()
+        return path, None
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+
+def validate_images(paths, workers):
+    if importlib.util.find_spec("PIL") is None:
+        print("⚠ Pillow が見つからないため画像の検証をスキップします。")
+        return {}
+    if not paths:
+        return {}
+    print(f"🧪 画像を検証中... ({len(paths)} 件 / workers={workers or os.cpu_count()})")
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        results = ex.map(validate_image, paths, chunksize=max(1, len(paths) // 64))
+        return {p: err for p, err in results if err}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="products.csv の id に合わせて商品画像のファイル名を変更します。")
+    parser.add_argument("--dry-run", action="store_true", help="変更内容を表示するだけで、ファイル名・マニフェストは変更しない")
+    parser.add_argument("--validate", action="store_true", help="画像をデコードして破損ファイルを検出する（Pillow が必要）")
+    parser.add_argument("--workers", type=int, default=None, help="検証に使うプロセス数（既定: CPU数）")
+    parser.add_argument("--full", action="store_true", help="マニフェストを無視して全件を処理する")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
     if not os.path.exists(CSV_PATH):
         print(f"❌ CSV が見つかりません: {CSV_PATH}")
         return
@@ -38,12 +182,18 @@ def main():
 
     print("🔄 CSVファイルと画像フォルダを確認中...")
 
-    # 画像フォルダの一覧を作っておく
-    files = os.listdir(IMG_DIR)
-    files_lower = [f.lower() for f in files]
+    # 画像フォルダの一覧と索引を作っておく
+    files = sorted(os.listdir(IMG_DIR))
+    file_set = set(files)
+    indexes = build_indexes(files)
+    manifest = {} if args.full else load_manifest(MANIFEST_PATH)
 
-    renamed = []
+    plan = []       # (pid, name, file_name_hint, 変更前, 変更後)
+    skipped = 0
     not_found = []
+    conflicts = []
+    claimed = set()
+    planned_names = set()
 
     # CSV を安全に開く
     with open_csv_safely(CSV_PATH) as f:
@@ -58,63 +208,88 @@ def main():
             if not pid:
                 continue
 
-            target_file = None
-
-            # 1) file_name があればそれを優先（拡張子はなんでもOK）
-            if file_name_hint:
-                try_name = file_name_hint.lower()
-                # 完全一致
-                if try_name in files_lower:
-                    target_file = files[files_lower.index(try_name)]
-                else:
-                    # 拡張子違いの可能性 → stem で探す
-                    stem = os.path.splitext(try_name)[0]
-                    for f in files:
-                        if os.path.splitext(f.lower())[0] == stem:
-                            target_file = f
-                            break
-
-            # 2) ダメなら商品名の部分一致でざっくり探す
-            if not target_file and name:
-                words = [w for w in normalize(name).split("_") if w]
-                for f in files:
-                    fl = normalize(os.path.splitext(f)[0])
-                    if all(w in fl for w in words[:2]):  # 2語くらい一致で採用
-                        target_file = f
-                        break
-
-            if target_file:
-                old_path = os.path.join(IMG_DIR, target_file)
-                ext = os.path.splitext(target_file)[1].lower() or ".jpg"
-                new_name = f"{pid}{ext}"
-                new_path = os.path.join(IMG_DIR, new_name)
-
-                if os.path.abspath(old_path) == os.path.abspath(new_path):
-                    # すでに想定名ならスキップ
-                    print(f"↪ そのまま: {target_file}")
-                else:
-                    # 既に同名がある場合は上書きを避けてスキップ
-                    if os.path.exists(new_path):
-                        print(f"⚠ 同名ありでスキップ: {new_name}  ← {target_file}")
-                    else:
-                        os.rename(old_path, new_path)
-                        renamed.append((target_file, new_name))
-                        print(f"✅ {target_file} → {new_name}")
-            else:
+            # 前回から変わっていない組み合わせはスキップ
+            if is_unchanged(manifest.get(pid), name, file_name_hint, file_set):
+                claimed.add(manifest[pid]["image"])
+                skipped += 1
+                continue
+
+            target_file = find_image(pid, name, file_name_hint, indexes, claimed)
+            if not target_file:
                 not_found.append(name or f"(id={pid})")
+                continue
+
+            ext = os.path.splitext(target_file)[1].lower() or ".jpg"
+            new_name = f"{pid}{ext}"
+            if new_name != target_file and (new_name in file_set or new_name in planned_names):
+                # 既に同名がある場合は上書きを避けてスキップ
+                conflicts.append((target_file, new_name))
+                print(f"⚠ 同名ありでスキップ: {new_name}  ← {target_file}")
+                continue
+
+            claimed.add(target_file)
+            planned_names.add(new_name)
+            plan.append((pid, name, file_name_hint, target_file, new_name))
+
+    # 画像の検証（任意）
+    corrupt = {}
+    if args.validate:
+        corrupt = validate_images([os.path.join(IMG_DIR, p[3]) for p in plan], args.workers)
+        for path, err in corrupt.items():
+            print(f"❌ 破損の可能性: {os.path.basename(path)} ({err})")
+
+    renamed = []
+    for pid, name, file_name_hint, target_file, new_name in plan:
+        old_path = os.path.join(IMG_DIR, target_file)
+        if old_path in corrupt:
+            continue
+
+        if target_file == new_name:
+            # すでに想定名ならスキップ
+            print(f"↪ そのまま: {target_file}")
+        elif args.dry_run:
+            renamed.append((target_file, new_name))
+            print(f"📝 (dry-run) {target_file} → {new_name}")
+        else:
+            os.rename(old_path, os.path.join(IMG_DIR, new_name))
+            renamed.append((target_file, new_name))
+            print(f"✅ {target_file} → {new_name}")
+
+        if not args.dry_run:
+            manifest[pid] = {
+                "name": name,
+                "file_name": file_name_hint,
+                "image": new_name,
+                **_stat(os.path.join(IMG_DIR, new_name)),
+            }
+
+    if args.dry_run:
+        print(f"\n🔚 dry-run: 変更予定 {len(renamed)} 件 / スキップ {skipped} 件 / 未マッチ {len(not_found)} 件")
+        return
+
+    save_manifest(MANIFEST_PATH, manifest)
 
-    # ログ出力
-    with open(LOG_PATH, "w", encoding="utf-8") as log:
-        log.write("=== 画像ファイル名変更ログ ===\n\n")
+    # ログ出力（実行ごとに追記）
+    with open(LOG_PATH, "a", encoding="utf-8") as log:
+        log.write(f"\n=== 画像ファイル名変更ログ ({datetime.now():%Y-%m-%d %H:%M:%S}) ===\n\n")
         for old, new in renamed:
             log.write(f"✅ {old} → {new}\n")
+        if conflicts:
+            log.write("\n=== 同名ありでスキップ ===\n")
+            for old, new in conflicts:
+                log.write(f"⚠ {new} ← {old}\n")
+        if corrupt:
+            log.write("\n=== 破損の可能性がある画像 ===\n")
+            for path, err in corrupt.items():
+                log.write(f"❌ {os.path.basename(path)}: {err}\n")
         if not_found:
             log.write("\n=== 見つからなかった商品 ===\n")
             for n in not_found:
                 log.write(f"⚠ {n}\n")
 
     print(f"\n📄 ログ: {LOG_PATH}")
-    print(f"🔚 完了: 変更 {len(renamed)} 件 / 未マッチ {len(not_found)} 件")
+    print(f"🧾 マニフェスト: {MANIFEST_PATH}")
+    print(f"🔚 完了: 変更 {len(renamed)} 件 / スキップ {skipped} 件 / 未マッチ {len(not_found)} 件 / 破損 {len(corrupt)} 件")
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,20 @@
 import re
-import random
+import time
+import logging
+import threading
 import unicodedata
+from collections import OrderedDict
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+from langchain_core.documents import Document
 import constants as ct
+import name_index
+import query_intent
+import rerank
+from metrics import METRICS
 
 def build_error_message(message: str) -> str:
     return f"{message}　{ct.COMMON_ERROR_MESSAGE}"
@@ -21,85 +30,65 @@ def _normalize_text(text: str) -> str:
 def preprocess_func(text: str) -> str:
     return _normalize_text(text)
 
+_PRODUCTS_CSV_PATH = Path(__file__).resolve().parent / "data" / "products.csv"
+
 def _load_products_df() -> pd.DataFrame:
-    csv_path = Path(__file__).resolve().parent / "data" / "products.csv"
     last_err = None
     for enc in ("utf-8", "utf-8-sig", "cp932"):
         try:
-            return pd.read_csv(csv_path, encoding=enc, dtype=str)
+            return pd.read_csv(_PRODUCTS_CSV_PATH, encoding=enc, dtype=str)
         except Exception as e:
             last_err = e
             continue
     raise RuntimeError(f"products.csv を読み込めませんでした: {last_err!s}")
 
-_STOCK_LOW = {"少", "すく", "わずか", "残りわずか", "わず"}
-_STOCK_NONE = {"ない", "無し", "なし", "在庫切れ"}
-_POPULAR = {"人気", "レビュー", "評価", "評判", "売れ", "ランキング"}
-
-_CATEGORIES = {
-    "イヤホン": ["イヤホン", "ワイヤレス", "ヘッドホン", "ear"],
-    "ライト": ["ライト", "照明", "デスクライト", "lamp"],
-    "加湿器": ["加湿器", "humid"],
-    "枕": ["枕", "ピロー"],
-    "時計": ["時計", "ウォッチ"],
-}
-
-def _parse_count(prompt: str, default: int = 1, limit: int = 5) -> int:
-    m = re.search(r"(\d+)\s*件|\s*(\d+)\s*つ|\s*(\d+)\s*個", prompt)
-    n = None
-    if m:
-        for g in m.groups():
-            if g:
-                n = int(g)
-                break
-    if n is None:
-        m2 = re.search(r"トップ\s*(\d+)", prompt)
-        if m2:
-            n = int(m2.group(1))
-    if n is None:
-        n = default
-    return max(1, min(limit, n))
-
-def _intent_from_prompt(prompt: str) -> dict:
-    p = _normalize_text(prompt)
-
-    stock = "any"
-    if any(w in p for w in _STOCK_NONE):
-        stock = "none"
-    elif any(w in p for w in _STOCK_LOW):
-        stock = "low"
+def _catalog_signature() -> str:
+    stat = _PRODUCTS_CSV_PATH.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
 
-    popular = any(w in p for w in _POPULAR)
+@st.cache_resource(show_spinner=False)
+def _build_catalog_features(signature: str, _vectors: dict = None) -> rerank.CatalogFeatures:
+    # signature（CSVの更新日時・サイズ・埋め込みの有無）が変わった時だけ再計算
+    return rerank.build_features(_load_products_df(), vectors=_vectors)
 
-    category = ""
-    for cat, kws in _CATEGORIES.items():
-        if any(_normalize_text(k) in p for k in kws):
-            category = cat
-            break
+def _catalog_features(signature: str) -> rerank.CatalogFeatures:
+    # Retriever 作成時に Chroma から取り出した埋め込み（なければハッシュ埋め込みで代替）
+    vectors = st.session_state.get("product_vectors") or None
+    return _build_catalog_features(f"{signature}:{'vectors' if vectors else 'hashed'}", vectors)
 
-    return {"stock": stock, "popular": popular, "category": category}
+@st.cache_resource(show_spinner=False)
+def _build_intent_engine(signature: str) -> query_intent.IntentEngine:
+    # 語彙はカタログ（category / maker / name 列）から作るため、カタログ更新時のみ再作成
+    return query_intent.IntentEngine.from_catalog(_catalog_features(signature).frame)
 
-def _doc_id(doc) -> str:
+def _intent_from_prompt(prompt: str) -> dict:
+    return _build_intent_engine(_catalog_signature()).parse(prompt, default_count=1, count_limit=5)
+
+@st.cache_resource(show_spinner=False)
+def _build_name_index(signature: str) -> name_index.NameIndex:
+    return name_index.NameIndex(
+        _catalog_features(signature).frame,
+        threshold=ct.NAME_MATCH_THRESHOLD,
+        margin=ct.NAME_MATCH_MARGIN,
+    )
+
+def _product_document(df: pd.DataFrame, row: int) -> Document:
+    # CSVLoader と同じ「列名: 値」形式で Document を作る
+    record = df.iloc[row].fillna("")
+    content = "\n".join(f"{str(k).strip()}: {str(v).strip()}" for k, v in record.items())
+    return Document(page_content=content, metadata={"source": ct.RAG_SOURCE_PATH, "row": int(row)})
+
+def id_from_text(text: str) -> str:
     try:
-        text = getattr(doc, "page_content", "") or ""
-        for line in text.splitlines():
+        for line in (text or "").splitlines():
             if line.lower().startswith("id:"):
                 return line.split(":", 1)[1].strip()
     except Exception:
         pass
     return ""
 
-def _score_text(text: str, query: str) -> int:
-    t = text or ""
-    q = query or ""
-    score = 0
-    for w in ["在庫", "人気", "おすすめ", "イヤホン", "枕", "加湿器", "ライト"]:
-        if (w in q) and (w in t):
-            score += 2
-    for field in ("name:", "category:", "description:", "maker:"):
-        if field in t:
-            score += 1
-    return score
+def _doc_id(doc) -> str:
+    return id_from_text(getattr(doc, "page_content", "") or "")
 
 def _safe_retrieve(prompt: str):
     retr = st.session_state.retriever
@@ -110,67 +99,108 @@ def _safe_retrieve(prompt: str):
         return retr.get_relevant_documents(prompt)
     raise RuntimeError("Retriever が無効です（invoke/get_relevant_documents の両方が見つかりません）。")
 
-def search_products(prompt: str):
-    want = _parse_count(prompt, default=1, limit=5)
-
+def _record_search(path: str, elapsed: float):
+    METRICS.incr("search.total")
+    METRICS.incr(f"search.{path}")
+    METRICS.observe(f"search.{path}", elapsed)
+
+    total = METRICS.count("search.total")
+    cache_hits = METRICS.count("search.cache")
+    # 名前索引のヒット率はキャッシュを除いた実際の検索に対して計算する
+    hits = METRICS.count("search.name_index")
+    searched = hits + METRICS.count("search.retrieval")
+    saved_ms = max(METRICS.mean_ms("search.retrieval") - METRICS.mean_ms("search.name_index"), 0.0)
+    logging.getLogger(ct.LOGGER_NAME).info({
+        "search": {
+            "path": path,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "cache_hit_ratio": round(cache_hits / total, 4) if total else 0.0,
+            "name_index_hit_ratio": round(hits / searched, 4) if searched else 0.0,
+            "name_index_saved_ms": round(hits * saved_ms, 3),
+        }
+    })
+
+# 検索結果のキャッシュ（結果は決定的なので、同じカタログ・同じ入力なら再利用できる）
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+def _cached_results(key):
+    with _RESULT_CACHE_LOCK:
+        docs = _RESULT_CACHE.get(key)
+        if docs is not None:
+            _RESULT_CACHE.move_to_end(key)
+        return docs
+
+def _store_results(key, docs: list):
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = docs
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > ct.SEARCH_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+
+def _rank_by_retrieval(prompt: str, intent: dict, signature: str) -> list:
     # Retriever 実行（互換呼び分け）
     docs = _safe_retrieve(prompt)
     if not isinstance(docs, list):
         docs = [docs]
 
-    intent = _intent_from_prompt(prompt)
-    df = _load_products_df()
-
-    stock = intent["stock"]
-    if stock == "none":
-        df = df[df["stock_status"] == ct.STOCK_NONE_TEXT]
-    elif stock == "low":
-        df = df[df["stock_status"] == ct.STOCK_LOW_TEXT]
-    elif stock == "any":
-        df = df[df["stock_status"] != ct.STOCK_NONE_TEXT]
-
-    cat = intent["category"]
-    if cat and not df.empty:
-        mask = (
-            df["name"].fillna("").str.contains(cat, case=False)
-            | df["category"].fillna("").str.contains(cat, case=False)
-            | df["description"].fillna("").str.contains(cat, case=False)
-        )
-        df = df[mask]
-
-    if intent["popular"] and not df.empty:
-        def _to_float(x):
-            try: return float(str(x))
-            except Exception: return 0.0
-        def _to_int(x):
-            try: return int(str(x).replace(",", ""))
-            except Exception: return 0
-        df["_score_num"] = df["score"].map(_to_float)
-        df["_review_num"] = df["review_number"].map(_to_int)
-        df = df.sort_values(by=["_score_num", "_review_num"], ascending=False)
-
-    id_candidates = [str(x) for x in df["id"].tolist()[: max(want, 1) * 5]] if not df.empty else []
-
-    picked = []
-    id_to_doc = {}
+    features = _catalog_features(signature)
+
+    # 候補プール（検索順を保ったまま商品ID単位で重複排除）
+    pool = []
+    seen = set()
     for d in docs:
         did = _doc_id(d)
-        if did:
-            id_to_doc.setdefault(did, d)
-    for did in id_candidates:
-        if did in id_to_doc and id_to_doc[did] not in picked:
-            picked.append(id_to_doc[did])
+        key = did or id(d)
+        if key in seen:
+            continue
+        seen.add(key)
+        pool.append(d)
+        if len(pool) >= ct.RERANK_POOL_SIZE:
+            break
 
-    if len(picked) < want:
-        remain = [d for d in docs if d not in picked]
-        remain.sort(key=lambda d: _score_text(getattr(d, "page_content", ""), prompt), reverse=True)
-        for d in remain:
-            picked.append(d)
-            if len(picked) >= want:
-                break
+    rows = np.array([features.id_to_row.get(_doc_id(d), -1) for d in pool], dtype=np.intp)
+    order = rerank.rerank(
+        features,
+        rows,
+        want=intent["count"],
+        stock=intent["stock"],
+        category=intent["category"],
+        maker=intent["maker"],
+        popular=intent["popular"],
+    )
+    return [pool[i] for i in order]
+
+def iter_search_products(prompt: str):
+    """
+    ランキング済みの商品を、準備でき次第 1 件ずつ返すジェネレータ
+    """
+    start = time.perf_counter()
+    signature = _catalog_signature()
+    cache_key = (signature, (prompt or "").strip())
+
+    cached = _cached_results(cache_key)
+    if cached is not None:
+        _record_search("cache", time.perf_counter() - start)
+        yield from cached
+        return
 
-    if len(picked) > want:
-        picked = random.sample(picked[: max(want * 3, want)], k=want)
+    intent = _intent_from_prompt(prompt)
 
-    return picked[:want]
+    # 商品名がほぼそのまま入力された場合は Retriever を通さずに返す
+    if intent["count"] == 1:
+        match = _build_name_index(signature).lookup(prompt)
+        if match is not None:
+            doc = _product_document(_catalog_features(signature).frame, match[0])
+            _store_results(cache_key, [doc])
+            _record_search("name_index", time.perf_counter() - start)
+            yield doc
+            return
+
+    docs = _rank_by_retrieval(prompt, intent, signature)
+    _store_results(cache_key, docs)
+    _record_search("retrieval", time.perf_counter() - start)
+    yield from docs
 
+def search_products(prompt: str):
+    return list(iter_search_products(prompt))